@@ -1,10 +1,12 @@
 """Representation of VOI Nearest Scooter Sensors."""
 
+import asyncio
 from datetime import timedelta
 import logging
+import math
 
-from geopy.distance import distance
-import requests
+import aiohttp
+import numpy as np
 import voluptuous as vol
 
 from homeassistant.components.sensor import PLATFORM_SCHEMA
@@ -16,14 +18,40 @@ from homeassistant.const import (
     CONF_NAME,
     LENGTH_METERS,
 )
+from homeassistant.exceptions import HomeAssistantError
+from homeassistant.helpers.aiohttp_client import async_get_clientsession
 import homeassistant.helpers.config_validation as cv
 from homeassistant.helpers.entity import Entity
 from homeassistant.util import Throttle
+import homeassistant.util.dt as dt_util
 from homeassistant.util.json import load_json, save_json
 
+try:
+    from cHaversine import haversine as _chaversine
+except ImportError:
+    _chaversine = None
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+try:
+    import orjson as _json
+except ImportError:
+    import json as _json
+
 _LOGGER = logging.getLogger(__name__)
 
 MIN_TIME_BETWEEN_UPDATES = timedelta(minutes=5)
+REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=15, connect=3.05, sock_read=10)
+RETRY_STATUSES = (502, 503, 504)
+RETRY_TOTAL = 2
+RETRY_BACKOFF = 0.3
+ZONE_CACHE_DURATION = timedelta(hours=24)
+
+EARTH_RADIUS = 6371000.0
+NEAREST_CANDIDATES = 8
 
 CONF_TOKEN_FILE = "token_file"
 
@@ -41,108 +69,250 @@ PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend(
 )
 
 
-def setup_platform(hass, config, add_entities, discovery_info=None):
+def _haversine_m(lats, lngs, lat0, lng0, cos_lat0):
+    """Return the haversine distances in meters of coordinates to an origin.
+
+    All coordinates are in radians, cos_lat0 is the cosine of the origin latitude.
+    """
+    a = (
+        np.sin((lats - lat0) / 2) ** 2
+        + cos_lat0 * np.cos(lats) * np.sin((lngs - lng0) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+
+def _nearest_prefiltered(lats, lngs, lat0, lng0, cos_lat0):
+    """Return index and distance in meters of the coordinates nearest to an origin.
+
+    Only the closest candidates by equirectangular approximation are measured
+    with the exact haversine formula, using cHaversine if it is installed.
+    """
+    count = len(lats)
+    dx = (lngs - lng0) * cos_lat0
+    dy = lats - lat0
+    approx = dx * dx + dy * dy
+    if count > NEAREST_CANDIDATES:
+        candidates = np.argpartition(approx, NEAREST_CANDIDATES)[:NEAREST_CANDIDATES]
+    else:
+        candidates = np.arange(count)
+
+    if _chaversine is not None:
+        origin = (math.degrees(lat0), math.degrees(lng0))
+        distance, index = min(
+            (
+                _chaversine((math.degrees(lats[i]), math.degrees(lngs[i])), origin),
+                int(i),
+            )
+            for i in candidates
+        )
+        return index, distance
+
+    distances = _haversine_m(lats[candidates], lngs[candidates], lat0, lng0, cos_lat0)
+    index = int(np.argmin(distances))
+    return int(candidates[index]), float(distances[index])
+
+
+def _nearest_haversine(lats, lngs, lat0, lng0, cos_lat0):
+    """Return index and distance in meters of the coordinates nearest to an origin.
+
+    Plain loop over all coordinates, meant to be compiled with Numba.
+    """
+    best_index = 0
+    best_a = 0.0
+    for i in range(len(lats)):
+        a = (
+            math.sin((lats[i] - lat0) / 2) ** 2
+            + cos_lat0 * math.cos(lats[i]) * math.sin((lngs[i] - lng0) / 2) ** 2
+        )
+        if i == 0 or a < best_a:
+            best_index = i
+            best_a = a
+    return best_index, 2 * EARTH_RADIUS * math.asin(math.sqrt(best_a))
+
+
+if njit is not None:
+    _nearest = njit(cache=True, fastmath=True)(_nearest_haversine)
+else:
+    _nearest = _nearest_prefiltered
+
+
+async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
     """Set up the sensor platform."""
     name = config.get(CONF_NAME)
     token_path = hass.config.path(config.get(CONF_TOKEN_FILE))
     latitude = hass.config.latitude
     longitude = hass.config.longitude
 
-    token_cache = load_json(token_path)
+    token_cache = await hass.async_add_executor_job(load_json, token_path)
     if not token_cache or "authentication_token" not in token_cache:
         raise ValueError("Missing or bad token file.")
 
-    add_entities([VoiNearestScooterSensor(name, token_path, latitude, longitude)])
+    if njit is not None:
+        # Compile the kernel, or load it from the cache, outside the event loop
+        coordinates = np.zeros(1)
+        await hass.async_add_executor_job(
+            _nearest, coordinates, coordinates, 0.0, 0.0, 1.0
+        )
+
+    api = VoiNearestScooterApi(hass, token_path, token_cache["authentication_token"])
+    async_add_entities([VoiNearestScooterSensor(name, api, latitude, longitude)])
 
 
 class VoiNearestScooterApi:
     """Representation of the VOI API."""
 
-    def __init__(self, token_path):
+    def __init__(self, hass, token_path, authentication_token):
         """Initialize the VOI API."""
+        self._hass = hass
         self._accessToken = None
+        self._authToken = authentication_token
         self._tokenPath = token_path
+        self._zone_id = None
+        self._zone_location = None
+        self._zone_cached_at = None
+        self._etags = {}
+        self._session = async_get_clientsession(hass)
 
     def __get_authentication_token(self):
-        """Load the authentication token from the token file."""
-        cache = load_json(self._tokenPath)
-        return cache["authentication_token"]
-
-    def __set_authentication_token(self, token):
-        """Save the authentication token to the token file."""
+        """Return the current authentication token."""
+        return self._authToken
+
+    async def __set_authentication_token(self, token):
+        """Save the authentication token to the token file if it changed."""
+        if token == self._authToken:
+            return
+        self._authToken = token
         cache = {"authentication_token": token}
-        save_json(self._tokenPath, cache)
-
-    @staticmethod
-    def __call(method, resource, headers=None, json=None):
-        """Call the VOI API and parse the response as JSON."""
-        result = requests.request(method, resource, headers=headers, json=json)
+        await self._hass.async_add_executor_job(save_json, self._tokenPath, cache)
+
+    async def __send(self, method, resource, retries=0, **kwargs):
+        """Send a request to the VOI API and read the response body.
+
+        Gateway errors are retried up to the given number of times with backoff.
+        """
+        for attempt in range(retries + 1):
+            async with self._session.request(
+                method, resource, timeout=REQUEST_TIMEOUT, **kwargs
+            ) as response:
+                content = await response.read()
+            if response.status not in RETRY_STATUSES or attempt == retries:
+                return response, content
+            await asyncio.sleep(RETRY_BACKOFF * 2**attempt)
+
+    async def __authenticate(self):
+        """Authenticate to the VOI API."""
+        body = {"authenticationToken": self.__get_authentication_token()}
+        response, content = await self.__send(
+            "POST", "https://api.voiapp.io/v1/auth/session", json=body
+        )
 
-        if result:
+        result = None
+        if response.ok:
             try:
-                return result.json()
+                result = _json.loads(content)
             except ValueError:
                 pass
 
-        _LOGGER.debug("Erroneous response (%s)", result)
-        return result
-
-    def __authenticate(self):
-        """Authenticate to the VOI API."""
-        body = {"authenticationToken": self.__get_authentication_token()}
-        result = self.__call("POST", "https://api.voiapp.io/v1/auth/session", json=body)
-
         if result and "accessToken" in result and "authenticationToken" in result:
             self._accessToken = result["accessToken"]
-            self.__set_authentication_token(result["authenticationToken"])
+            await self.__set_authentication_token(result["authenticationToken"])
         else:
-            _LOGGER.warning("Authentication failed: Erroneous response (%s)", result)
+            _LOGGER.warning("Authentication failed: Erroneous response (%s)", response)
 
-    def __request(self, method, resource, retry=True):
+    async def __request(self, method, resource, retry=True):
         """Issue an authenticated request to the VOI API."""
+        if self._accessToken is None and retry:
+            await self.__authenticate()
+            retry = False
+
+        if self._accessToken is None:
+            raise HomeAssistantError("Not authenticated to the VOI API")
+
         headers = {"x-access-token": self._accessToken}
-        result = self.__call(method, resource, headers=headers)
+        cached = self._etags.get(resource) if method == "GET" else None
+        if cached:
+            headers["If-None-Match"] = cached[0]
+
+        response, content = await self.__send(
+            method, resource, retries=RETRY_TOTAL, headers=headers
+        )
+        if response.status != 401 or not retry:
+            if response.status == 304 and cached:
+                return cached[1]
 
-        if result:
+            response.raise_for_status()
+            result = _json.loads(content)
+
+            etag = response.headers.get("ETag")
+            if method == "GET" and etag:
+                self._etags[resource] = (etag, result)
             return result
-        elif result.status_code == 401 and retry:
-            self.__authenticate()
-            return self.__request(method, resource, retry=False)
-        else:
-            raise requests.HTTPError(result)
 
-    def get_zones(self, latitude, longitude):
+        await self.__authenticate()
+        return await self.__request(method, resource, retry=False)
+
+    async def get_zones(self, latitude, longitude):
         """Get the list of zones of geo coordinates from the VOI API."""
-        result = self.__request(
+        result = await self.__request(
             "GET",
-            "https://api.voiapp.io/v1/zones?lat={}&lng={}".format(latitude, longitude),
+            f"https://api.voiapp.io/v1/zones?lat={latitude}&lng={longitude}",
         )
         if result and "zones" in result:
             return result["zones"]
 
-    def get_vehicles(self, latitude, longitude):
-        """Get the list of vehicles of a zone from the VOI API."""
-        result = self.get_zones(latitude, longitude)
+    async def __get_zone_id(self, latitude, longitude):
+        """Get the zone ID of geo coordinates, using the cached one if fresh."""
+        location = (latitude, longitude)
+        if (
+            self._zone_id is not None
+            and self._zone_location == location
+            and dt_util.utcnow() - self._zone_cached_at < ZONE_CACHE_DURATION
+        ):
+            return self._zone_id
+
+        self._zone_id = None
+        result = await self.get_zones(latitude, longitude)
         if result and "zone_id" in result[0]:
-            return self.__request(
+            self._zone_id = result[0]["zone_id"]
+            self._zone_location = location
+            self._zone_cached_at = dt_util.utcnow()
+        return self._zone_id
+
+    async def get_vehicles(self, latitude, longitude, retry=True):
+        """Get the list of vehicles of a zone from the VOI API."""
+        zone_id = await self.__get_zone_id(latitude, longitude)
+        if zone_id is None:
+            return None
+
+        try:
+            return await self.__request(
                 "GET",
-                "https://api.voiapp.io/v1/vehicles/zone/{}/ready".format(
-                    result[0]["zone_id"]
-                ),
+                f"https://api.voiapp.io/v1/vehicles/zone/{zone_id}/ready",
             )
+        except aiohttp.ClientResponseError as error:
+            if error.status != 404 or not retry:
+                raise
+            _LOGGER.debug("Zone %s not found, resolving it again", zone_id)
+            self._zone_id = None
+            return await self.get_vehicles(latitude, longitude, retry=False)
 
 
 class VoiNearestScooterSensor(Entity):
     """Representation of a VOI Nearest Scooter Sensor."""
 
-    def __init__(self, name, token_path, latitude, longitude):
+    def __init__(self, name, api, latitude, longitude):
         """Initialize the VOI Nearest Scooter Sensor."""
-        self._api = VoiNearestScooterApi(token_path)
+        self._api = api
         self._name = name
         self._latitude = latitude
         self._longitude = longitude
+        self._lat0_rad = math.radians(latitude)
+        self._lng0_rad = math.radians(longitude)
+        self._cos_lat0 = math.cos(self._lat0_rad)
         self._state = None
         self._attributes = {}
+        self._vehicles = None
+        self._nearest = None
 
     @property
     def name(self):
@@ -170,25 +340,38 @@ class VoiNearestScooterSensor(Entity):
         return self._attributes
 
     @Throttle(MIN_TIME_BETWEEN_UPDATES)
-    def update(self):
+    async def async_update(self):
         """Fetch new state data for the VOI Nearest Scooter Sensor."""
-        self._state = None
-        self._attributes = {}
-
-        vehicles = self._api.get_vehicles(self._latitude, self._longitude)
-        scooter = {}
-
-        if vehicles:
-            for vehicle in vehicles:
-                location_vehicle = (vehicle["location"][0], vehicle["location"][1])
-                location_hass = (self._latitude, self._longitude)
-                vehicle["distance"] = distance(location_vehicle, location_hass).m
+        vehicles = await self._api.get_vehicles(self._latitude, self._longitude)
+        if not vehicles:
+            self._state = None
+            self._attributes.clear()
+            return
+
+        # Unchanged responses are returned as the very same cached object
+        if vehicles is not self._vehicles:
+            count = len(vehicles)
+            lats = np.empty(count)
+            lngs = np.empty(count)
+            for i, vehicle in enumerate(vehicles):
+                location = vehicle["location"]
+                lats[i] = location[0]
+                lngs[i] = location[1]
+            np.radians(lats, out=lats)
+            np.radians(lngs, out=lngs)
+
+            self._vehicles = vehicles
+            self._nearest = _nearest(
+                lats, lngs, self._lat0_rad, self._lng0_rad, self._cos_lat0
+            )
 
-            scooter = sorted(vehicles, key=lambda item: item["distance"])[0]
+        index, scooter_distance = self._nearest
+        scooter = vehicles[index]
+        location = scooter["location"]
 
-        if scooter:
-            self._state = round(scooter["distance"])
-            self._attributes[ATTR_LATITUDE] = round(scooter["location"][0], 5)
-            self._attributes[ATTR_LONGITUDE] = round(scooter["location"][1], 5)
-            self._attributes[ATTR_BATTERY_LEVEL] = round(scooter["battery"])
-            self._attributes[ATTR_ATTRIBUTION] = ATTRIBUTION
+        self._state = round(scooter_distance)
+        self._attributes.clear()
+        self._attributes[ATTR_LATITUDE] = round(location[0], 5)
+        self._attributes[ATTR_LONGITUDE] = round(location[1], 5)
+        self._attributes[ATTR_BATTERY_LEVEL] = round(scooter["battery"])
+        self._attributes[ATTR_ATTRIBUTION] = ATTRIBUTION